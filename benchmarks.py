@@ -0,0 +1,106 @@
+"""
+Micro-benchmarks for the Ogg parsing hot paths.
+
+Run with ``python benchmarks.py``.
+"""
+
+import io
+import time
+import tracemalloc
+
+from traktor_nowplaying.ogg import OggParser, Packet, parse_comment
+from tests import make_comment, make_page
+
+
+def make_stream(seconds=60, bitrate=320000, packet_size=800):
+    """Build a Vorbis-like Ogg stream: three header packets followed by audio."""
+    pages = [
+        make_page([b'\x01vorbis' + bytes(23)], flags=2),
+        make_page([b'\x03vorbis' + bytes(100), b'\x05vorbis' + bytes(3000)], pageseq=1),
+    ]
+    audio = bytes(packet_size)
+    packets_per_page = 4
+    audio_pages = seconds * bitrate // 8 // (packet_size * packets_per_page)
+    for pageseq in range(2, audio_pages + 2):
+        pages.append(make_page([audio] * packets_per_page, pageseq=pageseq))
+    return b''.join(pages)
+
+
+def bench_skim(seconds=60, bitrate=320000, chunk_size=4096):
+    """
+    Compare the memory allocated per second of broadcast with and without
+    skim mode, feeding the stream ``chunk_size`` bytes at a time as it is
+    received. The traced memory peak is reset before each chunk, so that the
+    growth within each one adds up to the allocations made over the whole
+    run, rather than the peak of the parser buffer. Needs Python 3.9+.
+    """
+    data = make_stream(seconds, bitrate)
+    for skim in (False, True):
+        parser = OggParser(skim=skim)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        count = allocated = 0
+        for offset in range(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            events = parser.feed(chunk)
+            count += sum(isinstance(event, Packet) for event in events)
+            allocated += tracemalloc.get_traced_memory()[1] - traced
+            del events
+        elapsed = time.perf_counter() - started
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        retained = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+        print(f'skim={skim!s:5}  packets: {count:6}  allocated bytes/s of broadcast: '
+              f'{allocated // seconds:8}  retained: {retained:7}  time: {elapsed:.4f}s')
+
+
+def bench_crc(seconds=60, bitrate=320000):
+    """Compare pages parsed per second with and without CRC verification."""
+    data = make_stream(seconds, bitrate)
+    for verify_crc in (False, True):
+        parser = OggParser(verify_crc=verify_crc)
+        started = time.perf_counter()
+        parser.feed(data)
+        elapsed = time.perf_counter() - started
+        pages = data.count(b'OggS')
+        print(f'verify_crc={verify_crc!s:5}  pages/s: {pages / elapsed:10.0f}')
+
+
+def bench_pages(seconds=60, bitrate=320000, repeat=5):
+    """Report the best per-page parsing cost over ``repeat`` runs."""
+    data = make_stream(seconds, bitrate)
+    pages = data.count(b'OggS')
+    for skim in (False, True):
+        best = float('inf')
+        for _ in range(repeat):
+            parser = OggParser(skim=skim)
+            started = time.perf_counter()
+            parser.feed(data)
+            best = min(best, time.perf_counter() - started)
+        print(f'skim={skim!s:5}  per page: {best / pages * 1e6:6.2f} us')
+
+
+def bench_comment(number=2000):
+    """Compare decoding a bare comment header with one carrying large unmapped fields."""
+    fields = [b'ARTIST=Artist', b'TITLE=Title']
+    bare = make_comment(fields)
+    heavy = make_comment(fields + [
+        b'METADATA_BLOCK_PICTURE=' + bytes(200000),
+        b'LYRICS=' + b'la ' * 10000,
+    ])
+    for name, comment in (('bare', bare), ('heavy', heavy)):
+        started = time.perf_counter()
+        for _ in range(number):
+            parse_comment(comment)
+        elapsed = time.perf_counter() - started
+        print(f'{name:5}  {len(comment):7} bytes  per header: {elapsed / number * 1e6:6.2f} us')
+
+
+if __name__ == '__main__':
+    bench_skim()
+    bench_crc()
+    bench_pages()
+    bench_comment()
@@ -1,2 +1,3 @@
 from .version import __version__
-from .core import Listener
+from .core import Listener, Mount
+from .aio import AsyncListener
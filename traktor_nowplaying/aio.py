@@ -0,0 +1,548 @@
+"""
+Contains an asyncio implementation of the listener.
+"""
+
+import asyncio
+import functools
+import http
+import inspect
+import io
+import socket
+import traceback
+
+from .chunked import ChunkedDecoder
+from .core import Listener, mount_path, set_keepalive
+from .dispatch import Dispatcher
+from .options import HEARTBEAT_INTERVAL, REQUEST_TIMEOUT
+from .feed import EVENT_HEADERS, EVENTS, HEARTBEAT, OUTPUT, WEBSOCKET, NowPlaying, parse_event_id, split_endpoint
+from .ogg import OggParser, Page, comment_from_event
+from .relay import Relay, RelayError
+from .stream import StreamBuffer
+from .websocket import PING_FRAME, PROTOCOL_ERROR, FrameParser, WebSocketClient, accept_key, close_frame, handle_frame
+
+
+class AsyncDispatcher(Dispatcher):
+    """
+    ``Dispatcher`` whose workers are tasks of the event loop it is created
+    on rather than threads. Coroutine callbacks are awaited, and ``put`` and
+    ``close`` are coroutines.
+    """
+
+    def _start(self, workers):
+        lock = asyncio.Lock()
+        self._not_empty = asyncio.Condition(lock)
+        self._not_full = asyncio.Condition(lock)
+        self._tasks = [asyncio.ensure_future(self._run()) for _ in range(workers)]
+
+    async def put(self, callbacks, args):
+        """Queue a call of ``callbacks`` with ``args``."""
+        async with self._not_full:
+            while self._full() and not self._closed:
+                await self._not_full.wait()
+            self._enqueue(callbacks, args)
+            self._not_empty.notify()
+
+    async def _run(self):
+        while True:
+            async with self._not_empty:
+                while not self._queue and not self._closed:
+                    await self._not_empty.wait()
+                if not self._queue:
+                    return
+                callbacks, args = self._queue.popleft()
+                self._not_full.notify()
+
+            for callback in callbacks:
+                try:
+                    result = callback(*args)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception:
+                    traceback.print_exc()
+
+    async def close(self, timeout=None):
+        """
+        Stop the workers once the queued calls have run, waiting up to
+        ``timeout`` seconds for them.
+        """
+        async with self._not_empty:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+
+
+class AsyncRelay(Relay):
+    """
+    ``Relay`` for the event loop, whose ``connect`` is a coroutine. Pages
+    are copied to the transport, which keeps what the socket does not take
+    right away, up to ``max_pending`` bytes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._writer = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def connect(self, headers=None):
+        """Start the stream upstream, raising ``OSError`` on failure."""
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        except asyncio.TimeoutError:
+            raise RelayError(f'{self.url} timed out') from None
+
+        try:
+            writer.write(self._request(headers))
+            response = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.timeout)
+            self._check_response(response)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError) as error:
+            writer.close()
+            if isinstance(error, OSError):
+                raise
+            raise RelayError(f'{self.url} did not respond') from None
+
+        self._writer = writer
+
+    def send(self, page, header=False):
+        """Forward the data of a ``page`` without waiting, or drop it whole."""
+        if self._writer is None:
+            return
+        transport = self._writer.transport
+        if transport.is_closing():
+            # upstream went away
+            self.close()
+        elif transport.get_write_buffer_size() + len(page) > self.max_pending and not header:
+            self.dropped += len(page)
+        else:
+            # copied, as the transport may keep the data past the next feed of the parser, which reuses its buffer
+            self._writer.write(bytes(page))
+
+    def close(self):
+        """Stop relaying once the data kept by the transport is sent."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class AsyncStreamBuffer(StreamBuffer):
+    """``StreamBuffer`` whose ``wait`` is a coroutine of the event loop it is created on."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._published = asyncio.Event()
+
+    def publish(self, page):
+        super().publish(page)
+        # wakes up the current waiters only
+        self._published.set()
+        self._published.clear()
+
+    async def wait(self, position, timeout=None):
+        if self._next <= position and not self.closed:
+            try:
+                await asyncio.wait_for(self._published.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pages_after(position)
+
+    def close(self):
+        super().close()
+        self._published.set()
+
+
+class AsyncNowPlaying(NowPlaying):
+    """``NowPlaying`` whose ``wait`` is a coroutine of the event loop it is created on."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._updated = asyncio.Event()
+
+    def update(self, data):
+        super().update(data)
+        # wakes up the current waiters only
+        self._updated.set()
+        self._updated.clear()
+
+    async def wait(self, last_id, timeout=None):
+        if self._last_id <= last_id and not self.closed:
+            try:
+                await asyncio.wait_for(self._updated.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.events_after(last_id)
+
+    def close(self):
+        super().close()
+        self._updated.set()
+
+
+class AsyncWebSocketClient(WebSocketClient):
+    """
+    ``WebSocketClient`` writing to a stream writer of the event loop, the
+    frames it does not take right away being kept by its transport.
+    """
+
+    def __init__(self, writer, *args, **kwargs):
+        super().__init__(None, *args, **kwargs)
+        self._writer = writer
+
+    def send(self, frame):
+        if self.closed:
+            return
+        self._writer.write(frame)
+        if self._writer.transport.get_write_buffer_size() > self.max_pending:
+            # too slow to keep up: dropped along with what it has not taken
+            self.closed = True
+            self._writer.transport.abort()
+
+    def flush(self):
+        pass
+
+    def close(self, code=None):
+        if self.closed:
+            return
+        self.closed = True
+        if code is not None:
+            self._writer.write(close_frame(code))
+        self._writer.close()
+
+
+class AsyncListener(Listener):
+    """
+    Listens to Traktor broadcast from an asyncio event loop.
+
+    Takes the same arguments as ``Listener``. Every port is served from the
+    same loop, and every source connection is a coroutine on it rather than
+    a thread, with its pages parsed incrementally as they arrive. Callbacks
+    may be plain functions or coroutine functions, which are awaited; they
+    are queued to an ``AsyncDispatcher`` of ``dispatch_workers`` tasks.
+
+    Socket options are applied as by ``Listener``, but there is a single
+    process: ``workers`` is ignored. Idle timeouts are timers of the event
+    loop, cancelled and rescheduled with every read.
+
+    ``serve`` can be awaited on a running loop, while ``start``,
+    ``start_in_background`` and ``stop`` work as for ``Listener``, running
+    a loop of their own.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._servers = []
+        self._connections = set()  # stream writers of every connection being handled
+        self._pending = 0  # connections that have not sent their request yet
+        self._clients = 0
+        self._sources = {}  # (host, port, path) -> stream writer
+        self._loop = None
+
+    async def serve(self):
+        """Accept source connections until ``close`` is called or the task is cancelled."""
+        self._loop = asyncio.get_event_loop()
+        try:
+            for port, routes in self._create_routes().items():
+                handle = functools.partial(self._handle, routes)
+                # bound like the threaded listener, so that port 0 yields a single port
+                server = await asyncio.start_server(handle, host='0.0.0.0', port=port, reuse_port=self.reuse_port or None)
+                self._servers.append(server)
+                self.server_ports.append(server.sockets[0].getsockname()[1])
+            self._announce()
+            self.ready.set()
+
+            for server in self._servers:
+                await server.wait_closed()
+        finally:
+            self.close()
+            for dispatcher in self._dispatchers:
+                await dispatcher.close(timeout=1)
+            self._dispatchers = []
+            self._streams = []
+            self._feeds = []
+            self._servers = []
+            self.server_ports = []
+            self.ready.clear()
+
+    def close(self):
+        """Stop accepting connections, disconnecting every connection still open."""
+        for server in self._servers:
+            server.close()
+        # including those that never sent their request, which servers wait for once closed
+        for writer in list(self._connections):
+            writer.close()
+        for stream in self._streams:
+            stream.close()
+        for feed in self._feeds:
+            feed.close()
+
+    def stop(self, timeout=None):
+        """
+        Stop listening, from any thread. When started in the background,
+        waits up to ``timeout`` seconds for the listener's thread to finish.
+        """
+        if self._thread is not None:
+            self.ready.wait(timeout)
+
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self.close)
+            except RuntimeError:
+                # the loop has already been closed
+                pass
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def start(self):
+        """Start listening to Traktor broadcast on a new event loop."""
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.close()
+
+    def _create_stream(self):
+        return AsyncStreamBuffer(size=self.stream_buffer)
+
+    def _create_feed(self, mount):
+        return AsyncNowPlaying(history_size=mount.history_size)
+
+    def _create_dispatcher(self):
+        return AsyncDispatcher(
+            queue_size=self.queue_size,
+            workers=self.dispatch_workers,
+            overflow=self.overflow
+        )
+
+    async def _dispatch(self, callbacks, *args):
+        for callback in callbacks:
+            result = callback(*args)
+            if inspect.isawaitable(result):
+                await result
+
+    async def _handle(self, routes, reader, writer):
+        # connections that have not sent their request yet, neither sources nor clients
+        if self._pending >= self.max_connections + self.max_clients:
+            writer.close()
+            return
+
+        sock = writer.get_extra_info('socket')
+        if self.recv_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+        if self.keepalive:
+            set_keepalive(sock, self.keepalive)
+
+        self._connections.add(writer)
+        try:
+            self._pending += 1
+            try:
+                request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+            finally:
+                self._pending -= 1
+            await self._handle_request(routes, request, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, routes, request, reader, writer):
+        request_line, *header_lines = request.decode('latin-1').split('\r\n')
+        method, path = (request_line.split(' ') + ['/'])[:2]
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if method not in ('SOURCE', 'PUT', 'GET'):
+            writer.write(b'HTTP/1.0 501 Unsupported method\r\n\r\n')
+            return
+
+        # a reconnecting source replaces its previous (possibly stale) connection
+        source = (writer.get_extra_info('peername')[0], writer.get_extra_info('sockname')[1], path)
+        if method == 'GET':
+            full = self._clients >= self.max_clients
+        else:
+            full = source not in self._sources and len(self._sources) >= self.max_connections
+        if full:
+            writer.write(b'HTTP/1.0 503 Service Unavailable\r\n\r\n')
+            return
+
+        if method == 'GET':
+            self._clients += 1
+            try:
+                await self._handle_get(routes, path, headers, reader, writer)
+            finally:
+                self._clients -= 1
+            return
+
+        route = routes.get(mount_path(path), routes.get(None))
+        if route is None:
+            writer.write(b'HTTP/1.0 404 Not Found\r\n\r\n')
+            return
+
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.0 100 Continue\r\n\r\n')
+        writer.write(b'HTTP/1.0 200 OK\r\n\r\n')
+        chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+
+        previous = self._sources.get(source)
+        if previous is not None:
+            previous.close()
+        self._sources[source] = writer
+        relay = None
+
+        try:
+            relay = await self._connect_relay(route.relay, headers)
+            await self._stream(reader, route.callbacks, chunked, relay, route.stream)
+        except asyncio.TimeoutError:
+            # the source stalled without closing the connection
+            await self._dispatch(route.idle_callbacks, self.idle_timeout)
+        finally:
+            if self._sources.get(source) is writer:
+                del self._sources[source]
+            if relay is not None:
+                relay.close()
+
+    async def _connect_relay(self, url, headers):
+        """Start relaying the source to ``url``, if any."""
+        if url is None:
+            return None
+
+        relay = AsyncRelay(url)
+        try:
+            await relay.connect(headers)
+        except OSError as error:
+            print(f'Could not relay to {url}: {error}')
+            return None
+        return relay
+
+    async def _handle_get(self, routes, path, headers, reader, writer):
+        """Serve the now playing feed of a mount, or its stream to a listener."""
+        path, endpoint = split_endpoint(path)
+        route = routes.get(mount_path(path), routes.get(None))
+
+        if route is not None and endpoint == OUTPUT and route.output is not None:
+            status, response_headers, body = route.output.respond(headers.get('accept-encoding'), headers.get('if-none-match'))
+            writer.write(self._response_head(status, response_headers) + body)
+        elif route is not None and endpoint == EVENTS and route.feed is not None:
+            await self._send_events(writer, route.feed, parse_event_id(headers.get('last-event-id')))
+        elif route is not None and endpoint == WEBSOCKET and route.feed is not None:
+            await self._serve_websocket(reader, writer, route.feed, headers)
+        elif route is not None and endpoint not in (None, OUTPUT) and route.feed is not None:
+            status, response_headers, body = route.feed.respond(endpoint, headers.get('if-none-match'))
+            writer.write(self._response_head(status, response_headers) + body)
+        elif route is not None and endpoint is None and route.stream is not None:
+            await self._serve_stream(writer, route.stream)
+        else:
+            writer.write(b'HTTP/1.0 404 Not Found\r\n\r\n')
+
+    @staticmethod
+    def _response_head(status, headers):
+        lines = [f'HTTP/1.0 {status} {http.HTTPStatus(status).phrase}']
+        lines.extend(f'{name}: {value}' for name, value in headers)
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _send_events(self, writer, feed, last_id):
+        """Push the events of the feed to a subscriber, until it goes away."""
+        writer.write(self._response_head(200, EVENT_HEADERS))
+        last_id, events = feed.events_after(last_id)
+        while not feed.closed:
+            writer.write(b''.join(events) if events else HEARTBEAT)
+            # a subscriber not keeping up within the idle timeout is disconnected
+            await asyncio.wait_for(writer.drain(), self.idle_timeout)
+            last_id, events = await feed.wait(last_id, HEARTBEAT_INTERVAL)
+
+    async def _serve_websocket(self, reader, writer, feed, headers):
+        """Push the track changes of the feed to a WebSocket client, until it goes away."""
+        key = headers.get('sec-websocket-key')
+        if 'websocket' not in headers.get('upgrade', '').lower() or not key:
+            writer.write(b'HTTP/1.0 400 Bad Request\r\n\r\n')
+            return
+
+        writer.write(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept_key(key).encode('ascii') + b'\r\n\r\n'
+        )
+        client = AsyncWebSocketClient(writer)
+        parser = FrameParser()
+        feed.subscribe(client)
+
+        pinged = False
+        try:
+            while not client.closed:
+                try:
+                    data = await asyncio.wait_for(reader.read(65536), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if pinged:
+                        # no answer to the ping
+                        break
+                    client.send(PING_FRAME)
+                    pinged = True
+                    continue
+                if not data:
+                    break
+                pinged = False
+                for opcode, payload in parser.feed(data):
+                    if not handle_frame(client, opcode, payload):
+                        break
+        except ValueError:
+            client.close(PROTOCOL_ERROR)
+        finally:
+            feed.unsubscribe(client)
+            client.close()
+
+    async def _serve_stream(self, writer, stream_buffer):
+        """Serve the stream of a mount to a listener."""
+        writer.write(
+            b'HTTP/1.0 200 OK\r\n'
+            b'Content-Type: application/ogg\r\n'
+            b'Cache-Control: no-cache\r\n\r\n'
+        )
+        position, pages = stream_buffer.subscribe()
+        while not stream_buffer.closed:
+            for page in pages:
+                writer.write(page)
+            # a listener not keeping up within the idle timeout is disconnected
+            await asyncio.wait_for(writer.drain(), self.idle_timeout)
+            position, pages = await stream_buffer.wait(position)
+
+    async def _stream(self, reader, callbacks, chunked=False, relay=None, stream_buffer=None):
+        """
+        Parse the incoming stream, passing metadata to the callbacks and
+        its pages to the relay and the stream buffer.
+        """
+        decoder = ChunkedDecoder() if chunked else None
+        parser = OggParser(
+            skim=True,
+            verify_crc=self.verify_crc,
+            resync=True,
+            max_packet_size=self.max_packet_size,
+            pages=relay is not None or stream_buffer is not None
+        )
+
+        while True:
+            data = await asyncio.wait_for(reader.read(io.DEFAULT_BUFFER_SIZE), self.idle_timeout)
+            if not data:
+                return
+            for piece in decoder.feed(data) if decoder else (data,):
+                for event in parser.feed(piece):
+                    if isinstance(event, Page):
+                        if relay is not None:
+                            relay.send(event.data, event.header)
+                        if stream_buffer is not None:
+                            stream_buffer.publish(event)
+                        continue
+                    metadata = comment_from_event(event, self.comment_fields)
+
+                    if metadata is not None:
+                        await self._dispatch(callbacks, metadata)
+            if decoder and decoder.done:
+                return
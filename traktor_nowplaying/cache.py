@@ -0,0 +1,103 @@
+"""
+Contains the cache of responses served over HTTP with content encoding.
+"""
+
+from typing import List, Optional, Tuple
+import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# by order of preference
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def compress(body, encoding) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body)
+    # gzip container, without the modification time gzip.compress sets
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def not_modified(etag, if_none_match) -> bool:
+    """Whether an ``If-None-Match`` header matches ``etag``, using the weak comparison."""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().replace('W/', '', 1) for tag in if_none_match.split(',')}
+    return etag in tags or '*' in tags
+
+
+def negotiate(accept_encoding) -> Optional[str]:
+    """
+    Pick the preferred encoding of ``ENCODINGS`` accepted by an
+    ``Accept-Encoding`` header, or ``None`` for the identity.
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+class CachedResponse:
+    """
+    A response body with its ETag, served as is or compressed with any of
+    ``ENCODINGS``. Each encoding is compressed once, when first asked for,
+    and not at all if that would not make the body smaller.
+    """
+
+    def __init__(self, body: bytes, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        self._encoded = {}  # encoding -> compressed body, or None if not smaller
+
+    def encoded(self, encoding) -> Optional[bytes]:
+        if encoding not in self._encoded:
+            data = compress(self.body, encoding)
+            self._encoded[encoding] = data if len(data) < len(self.body) else None
+        return self._encoded[encoding]
+
+    def respond(self, accept_encoding=None, if_none_match=None) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """
+        Return the status, headers and body of the response to a ``GET``
+        request with the given ``Accept-Encoding`` and ``If-None-Match``.
+        """
+        encoding = negotiate(accept_encoding)
+        body = self.encoded(encoding) if encoding else None
+        if body is None:
+            encoding, body = None, self.body
+
+        # each encoding is a representation of its own, with its own tag
+        etag = self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+        headers = [
+            ('Content-Type', self.content_type),
+            ('Cache-Control', 'no-cache'),
+            ('Access-Control-Allow-Origin', '*'),
+            ('Vary', 'Accept-Encoding'),
+            ('ETag', etag),
+        ]
+
+        if not_modified(etag, if_none_match):
+            return 304, headers, b''
+
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        return 200, headers + [('Content-Length', str(len(body)))], body
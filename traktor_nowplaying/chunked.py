@@ -0,0 +1,113 @@
+"""
+Contains a streaming decoder for HTTP chunked transfer encoding, used for
+source clients sending their stream with PUT.
+"""
+
+from typing import List
+import io
+
+
+# longest chunk size line (size and extensions) or trailer line accepted
+MAX_LINE_LENGTH = 1024
+
+
+class ChunkedDecoder:
+    """
+    Incremental decoder for ``Transfer-Encoding: chunked`` bodies.
+
+    ``feed`` strips the framing from whatever bytes have arrived and returns
+    the payload they contain as ``memoryview`` slices of the data passed in,
+    so chunks are never buffered whole. Only a partial size or trailer line
+    is kept between calls. ``done`` is set once the last chunk and trailers
+    have been read; anything fed after that is ignored.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._line = bytearray()  # partial size or trailer line
+        self._remaining = 0  # payload bytes left in the current chunk
+        self._crlf = 0  # bytes of the CRLF ending the current chunk still to skip
+        self._trailers = False  # whether the last chunk was seen
+
+    def feed(self, data) -> List[memoryview]:
+        """Decode ``data`` and return the payload it contains."""
+        view = memoryview(data)
+        find = data.find if hasattr(data, 'find') else bytes(view).find
+        size = len(view)
+        pos = 0
+        payload = []
+
+        while pos < size and not self.done:
+            if self._remaining:
+                end = min(size, pos + self._remaining)
+                payload.append(view[pos:end])
+                self._remaining -= end - pos
+                pos = end
+            elif self._crlf:
+                skipped = min(size - pos, self._crlf)
+                self._crlf -= skipped
+                pos += skipped
+            else:
+                newline = find(b'\n', pos)
+                end = size if newline == -1 else newline + 1
+                self._line += view[pos:end]
+                pos = end
+                if len(self._line) > MAX_LINE_LENGTH:
+                    raise ValueError('Chunk size line too long')
+                if newline != -1:
+                    self._parse_line(bytes(self._line).strip())
+                    self._line.clear()
+
+        return payload
+
+    def _parse_line(self, line):
+        if self._trailers:
+            # an empty line ends the trailers, and the body
+            self.done = not line
+            return
+
+        try:
+            self._remaining = int(line.split(b';', 1)[0], 16)
+        except ValueError:
+            raise ValueError(f'Invalid chunk size line: {line!r}') from None
+
+        if self._remaining:
+            self._crlf = 2
+        else:
+            self._trailers = True
+
+
+class ChunkedReader(io.RawIOBase):
+    """
+    Read-only file object decoding the chunked body read from ``raw``, so that
+    it can be handed to ``ogg.parse_events`` like any other stream.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.decoder = ChunkedDecoder()
+        self._read = getattr(raw, 'read1', raw.read)
+        self._pending = []  # decoded payload not yet read, in reverse order
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._pending:
+            if self.decoder.done:
+                return 0
+            data = self._read(io.DEFAULT_BUFFER_SIZE)
+            if not data:
+                return 0
+            self._pending = self.decoder.feed(data)[::-1]
+
+        piece = self._pending[-1]
+        size = min(len(b), len(piece))
+        b[:size] = piece[:size]
+        if size == len(piece):
+            self._pending.pop()
+        else:
+            self._pending[-1] = piece[size:]
+        return size
+
+    readinto1 = readinto
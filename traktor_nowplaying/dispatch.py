@@ -0,0 +1,111 @@
+"""
+Contains the dispatcher running callbacks off the threads reading sources.
+"""
+
+from collections import deque
+from typing import Callable, List
+import threading
+import traceback
+
+from .options import QUEUE_SIZE, DISPATCH_WORKERS, OVERFLOW
+
+
+DROP_OLDEST = 'drop-oldest'
+COALESCE = 'coalesce'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, COALESCE, BLOCK)
+
+
+class Dispatcher:
+    """
+    Runs callbacks on worker threads, fed through a queue of at most
+    ``queue_size`` calls, so that a slow callback does not hold up parsing.
+
+    ``overflow`` decides what happens to a call made while the queue is
+    full: ``drop-oldest`` discards the oldest queued call, ``block`` waits
+    for room (stalling the caller) and ``coalesce`` only ever keeps the
+    latest call of each set of callbacks queued, as only the current track
+    matters, dropping the oldest call when still full.
+
+    With a single worker callbacks run in order; more workers let slow
+    callbacks overlap, at the cost of ordering.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE, workers=DISPATCH_WORKERS, overflow=OVERFLOW):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy: {overflow}')
+
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = deque()  # (callbacks, args) calls waiting for a worker
+        self._closed = False
+        self._start(workers)
+
+    def wrap(self, callbacks: List[Callable]) -> List[Callable]:
+        """Wrap ``callbacks`` into a list of one callable queueing calls to them."""
+        callbacks = list(callbacks)
+        if not callbacks:
+            return []
+        return [lambda *args: self.put(callbacks, args)]
+
+    def _enqueue(self, callbacks, args):
+        """Queue a call, making room according to the overflow policy."""
+        if self.overflow == COALESCE:
+            superseded = [call for call in self._queue if call[0] is callbacks]
+            for call in superseded:
+                self._queue.remove(call)
+            self.dropped += len(superseded)
+
+        if len(self._queue) >= self.queue_size:
+            self._queue.popleft()
+            self.dropped += 1
+
+        self._queue.append((callbacks, args))
+
+    def _full(self):
+        return self.overflow == BLOCK and len(self._queue) >= self.queue_size
+
+    def _start(self, workers):
+        lock = threading.Lock()
+        self._not_empty = threading.Condition(lock)
+        self._not_full = threading.Condition(lock)
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def put(self, callbacks, args):
+        """Queue a call of ``callbacks`` with ``args``."""
+        with self._not_full:
+            while self._full() and not self._closed:
+                self._not_full.wait()
+            self._enqueue(callbacks, args)
+            self._not_empty.notify()
+
+    def _run(self):
+        while True:
+            with self._not_empty:
+                while not self._queue and not self._closed:
+                    self._not_empty.wait()
+                if not self._queue:
+                    return
+                callbacks, args = self._queue.popleft()
+                self._not_full.notify()
+
+            for callback in callbacks:
+                try:
+                    callback(*args)
+                except Exception:
+                    traceback.print_exc()
+
+    def close(self, timeout=None):
+        """
+        Stop the workers once the queued calls have run, waiting up to
+        ``timeout`` seconds for each of them.
+        """
+        with self._not_empty:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
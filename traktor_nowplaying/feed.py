@@ -0,0 +1,176 @@
+"""
+Contains the in-memory now playing feed served over HTTP.
+"""
+
+from collections import deque
+from typing import List, Tuple
+import hashlib
+import itertools
+import json
+import threading
+
+from .cache import not_modified
+from .options import HISTORY_SIZE
+from .websocket import GOING_AWAY, encode_frame
+
+
+NOWPLAYING = 'nowplaying.json'
+HISTORY = 'history.json'
+EVENTS = 'events'
+WEBSOCKET = 'ws'
+OUTPUT = 'output'
+ENDPOINTS = (NOWPLAYING, HISTORY, EVENTS, WEBSOCKET, OUTPUT)
+
+HEADERS = [
+    ('Content-Type', 'application/json'),
+    ('Cache-Control', 'no-cache'),
+    ('Access-Control-Allow-Origin', '*'),
+]
+
+EVENT_HEADERS = [
+    ('Content-Type', 'text/event-stream'),
+    ('Cache-Control', 'no-cache'),
+    ('Access-Control-Allow-Origin', '*'),
+]
+
+# sent to event stream subscribers when there has been no event for a while
+HEARTBEAT = b': heartbeat\n\n'
+
+
+def parse_event_id(value):
+    """Parse a ``Last-Event-ID`` header, returning ``None`` if missing or invalid."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def split_endpoint(path):
+    """
+    Split a request path into the path of the mount and the feed endpoint
+    it asks for, or ``None`` if it asks for none.
+    """
+    mount, _, name = path.split('?', 1)[0].rstrip('/').rpartition('/')
+    if name not in ENDPOINTS:
+        return path, None
+    return mount or '/', name
+
+
+class NowPlaying:
+    """
+    Keeps the current track of a mount and the ``history_size`` tracks
+    before it, serving them as ``nowplaying.json`` and ``history.json``.
+
+    Responses are serialized once, when the track changes, along with a
+    strong ETag, so that polling with ``If-None-Match`` costs a string
+    comparison until the next track. The same track sent again (eg. when
+    the source reconnects) is not a change.
+
+    Each track is also an event of the ``events`` stream (Server-Sent
+    Events), numbered from 1 and serialized once. Subscribers get the
+    current track when they connect, or, when reconnecting with a
+    ``Last-Event-ID``, the tracks they missed that are still in the history.
+
+    Clients of the ``ws`` endpoint (WebSocket) are ``subscribe``d, each
+    track being encoded once into a text frame broadcast to all of them;
+    they get the current track when they subscribe too.
+    """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.history = deque(maxlen=history_size + 1)  # the current track and those before it
+        self.closed = False
+        self._events = deque(maxlen=history_size + 1)  # serialized events of the history
+        self._last_id = 0  # id of the last event
+        self._frame = None  # WebSocket frame of the current track
+        self._clients = set()
+        self._responses = {}
+        self._changed = threading.Condition()
+        self._serialize()
+
+    @property
+    def current(self):
+        return self.history[-1] if self.history else None
+
+    def update(self, data: List[tuple]):
+        info = dict(data)
+
+        if not ('artist' in info or 'title' in info) or info == self.current:
+            return
+
+        with self._changed:
+            self.history.append(info)
+            self._serialize()
+            self._last_id += 1
+            data = json.dumps(info, ensure_ascii=False)
+            self._events.append(f'id: {self._last_id}\ndata: {data}\n\n'.encode('utf-8'))
+            self._frame = encode_frame(data.encode('utf-8'))
+            for client in list(self._clients):
+                client.send(self._frame)
+            self._changed.notify_all()
+
+    def _serialize(self):
+        responses = {}
+        for name, value in ((NOWPLAYING, self.current), (HISTORY, list(self.history)[:-1])):
+            body = json.dumps(value, ensure_ascii=False).encode('utf-8')
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            responses[name] = (body, etag)
+        # swapped in whole, for handlers reading from other threads
+        self._responses = responses
+
+    def respond(self, endpoint, if_none_match=None) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """
+        Return the status, headers and body of the response to a ``GET``
+        request for ``endpoint``.
+        """
+        body, etag = self._responses[endpoint]
+        headers = HEADERS + [('ETag', etag)]
+
+        if not_modified(etag, if_none_match):
+            return 304, headers, b''
+
+        return 200, headers + [('Content-Length', str(len(body)))], body
+
+    def events_after(self, last_id=None) -> Tuple[int, List[bytes]]:
+        """
+        Return the id of the last event and the events following
+        ``last_id``, or only the last event if ``last_id`` is ``None`` (or
+        from before a restart).
+        """
+        with self._changed:
+            if last_id is None or last_id > self._last_id:
+                last_id = self._last_id - 1
+            first = self._last_id - len(self._events) + 1  # id of the oldest event kept
+            start = max(last_id + 1, first) - first
+            return self._last_id, list(itertools.islice(self._events, start, None))
+
+    def wait(self, last_id, timeout=None) -> Tuple[int, List[bytes]]:
+        """
+        Like ``events_after``, but waiting up to ``timeout`` seconds for an
+        event following ``last_id`` first.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._last_id > last_id or self.closed, timeout)
+            return self.events_after(last_id)
+
+    def subscribe(self, client):
+        """Add a ``WebSocketClient``, sending it the current track."""
+        with self._changed:
+            if self.closed:
+                client.close(GOING_AWAY)
+                return
+            if self._frame is not None:
+                client.send(self._frame)
+            self._clients.add(client)
+
+    def unsubscribe(self, client):
+        with self._changed:
+            self._clients.discard(client)
+
+    def close(self):
+        """Wake up the subscribers waiting for events and close clients, for good."""
+        with self._changed:
+            self.closed = True
+            for client in list(self._clients):
+                client.close(GOING_AWAY)
+            self._clients.clear()
+            self._changed.notify_all()
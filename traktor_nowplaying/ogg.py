@@ -28,70 +28,458 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-from typing import List
+from typing import List, NamedTuple
+import io
 import struct
-import os
-import codecs
+import zlib
 
 
-def parse_pages(fh):
-    # for the spec, see: https://wiki.xiph.org/Ogg
-    previous_page = b''  # contains data from previous (continuing) pages
-    header_data = fh.read(27)  # read ogg page header
-    while len(header_data) != 0:
-        header = struct.unpack('<4sBBqIIiB', header_data)
+# page header: capture pattern, version, flags, granule position, serial,
+# page sequence number, checksum and number of segments
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+UINT32 = struct.Struct('<I')
+
+# largest possible page: header, a full segment table and 255 full segments
+MAX_PAGE_SIZE = 27 + 255 + 255 * 255
+
+# number of header packets at the start of each Vorbis logical stream
+HEADER_PACKETS = 3
+
+
+# maps every byte to the same byte with its bits in reverse order
+_REVERSED_BITS = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+
+def page_crc(page) -> int:
+    """
+    Return the Ogg CRC32 of a complete page, computed as if its checksum field
+    were zero.
+
+    Ogg uses the non-reflected form of the CRC32 polynomial, with no initial
+    value or final xor. That equals the reflected CRC32 implemented by
+    ``zlib`` (which runs in C with slicing tables of its own) applied to the
+    page with the bits of every byte reversed, and then bit-reversed itself.
+    Reversing the bits goes through a precomputed translation table.
+    """
+    data = bytearray(page)
+    data[22:26] = bytes(4)
+    crc = zlib.crc32(data.translate(_REVERSED_BITS), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int.from_bytes(crc.to_bytes(4, 'little').translate(_REVERSED_BITS), 'big')
+
+
+class Packet(NamedTuple):
+    """
+    A complete packet of the logical stream identified by ``serial``.
+
+    ``index`` is the position of the packet within its logical stream, or -1
+    if the beginning of that stream was never seen.
+    """
+    serial: int
+    index: int
+    data: memoryview
+
+
+class Page(NamedTuple):
+    """
+    A complete page of the logical stream identified by ``serial``, header
+    and all. ``header`` is set for the pages carrying the header packets of
+    a stream whose beginning was seen.
+    """
+    serial: int
+    header: bool
+    data: memoryview
+
+
+class StreamStarted(NamedTuple):
+    """A logical stream began (its first page had the BOS flag set)."""
+    serial: int
+
+
+class StreamEnded(NamedTuple):
+    """A logical stream ended (its last page had the EOS flag set)."""
+    serial: int
+
+
+class Resynced(NamedTuple):
+    """Parsing resumed at a capture pattern after skipping invalid bytes."""
+    skipped: int
+
+
+class PacketTooLarge(NamedTuple):
+    """
+    A packet grew past the maximum packet size after ``size`` bytes and the
+    rest of it was discarded.
+    """
+    serial: int
+    size: int
+
+
+class CorruptPage(NamedTuple):
+    """A page which failed CRC verification and was dropped."""
+    serial: int
+    pageseq: int
+
+
+class OggParser:
+    """
+    Incremental (push-style) Ogg parser.
+
+    Bytes are pushed in with ``feed`` or, to avoid copying, read straight into
+    the parser's own buffer using ``get_buffer`` and ``buffer_updated`` (the
+    same protocol as ``asyncio.BufferedProtocol``). Partial headers, segment
+    tables and continued packets are kept across calls. Both return the list
+    of events completed by the new data.
+
+    Logical streams are tracked by serial number: ``StreamStarted`` and
+    ``StreamEnded`` events are emitted for pages carrying the BOS and EOS
+    flags, and every ``Packet`` knows its index within its stream.
+
+    Packet data are ``memoryview`` slices of internal buffers. They are only
+    valid until the next call to ``feed`` or ``get_buffer``, at which point
+    they are released and any further access raises ``ValueError``. Use
+    ``bytes(packet.data)`` to keep a packet.
+
+    With ``skim`` set, only the first ``HEADER_PACKETS`` packets following the
+    beginning of each logical stream are assembled. Every other page is
+    dropped without assembling its packets: its lacing values are only
+    summed up to find where it ends.
+
+    With ``verify_crc`` set, the checksum of every page whose packets are
+    assembled is verified. Pages that fail are dropped, along with any packet
+    they continue, and reported with a ``CorruptPage`` event.
+
+    With ``resync`` set, data which does not start with a valid page header
+    is skipped up to the next ``OggS`` capture pattern instead of raising an
+    exception. Parsing then carries on and a ``Resynced`` event reports how
+    many bytes were skipped; ``bytes_skipped`` keeps the running total.
+
+    With ``max_packet_size`` set, a packet growing past that many bytes is
+    not buffered any further: a ``PacketTooLarge`` event is emitted and the
+    rest of the packet is discarded as it arrives.
+
+    With ``pages`` set, a ``Page`` event is emitted for every complete page,
+    skimmed or not, before the events of its packets. Its data is a view of
+    the page in the buffer, valid for as long as packet data are. With
+    ``verify_crc`` also set, skimmed pages are verified too, and pages that
+    fail are only reported by their ``CorruptPage`` event.
+    """
+
+    def __init__(self, skim=False, verify_crc=False, resync=False, max_packet_size=None, pages=False):
+        self.skim = skim
+        self.pages = pages
+        self.verify_crc = verify_crc
+        self.resync = resync
+        self.max_packet_size = max_packet_size
+        self.bytes_skipped = 0
+        self._skipped = 0  # bytes skipped since the last valid page header
+        self._buffer = bytearray(2 * MAX_PAGE_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # offset of the first byte not yet parsed
+        self._end = 0  # offset just past the last byte received
+        self._exports = []  # views handed out since the last call
+        self._previous_page = bytearray()  # contains data from previous (continuing) pages
+        self._discarding = False  # whether the continuing packet was too large
+        self._streams = {}  # serial -> packets seen, for streams whose beginning was seen
+
+    def feed(self, data) -> List[tuple]:
+        """Parse ``data`` and return the events it completes."""
+        size = len(data)
+        self.get_buffer(size)[:size] = data
+        return self.buffer_updated(size)
+
+    def get_buffer(self, sizehint=-1) -> memoryview:
+        """Return a writable view of at least ``sizehint`` free bytes."""
+        self._release()
+        pending = self._end - self._start
+        needed = max(sizehint, 1)
+
+        if len(self._buffer) - self._end < needed:
+            if pending + needed <= len(self._buffer):
+                # memoryview assignment copes with overlapping ranges
+                self._view[:pending] = self._view[self._start:self._end]
+            else:
+                buffer = bytearray(max(2 * len(self._buffer), pending + needed))
+                buffer[:pending] = self._view[self._start:self._end]
+                self._buffer = buffer
+                self._view = memoryview(buffer)
+            self._start, self._end = 0, pending
+
+        free = self._view[self._end:]
+        self._exports.append(free)
+        return free
+
+    def buffer_updated(self, nbytes) -> List[tuple]:
+        """Parse the ``nbytes`` written into the last ``get_buffer`` view."""
+        self._release()
+        self._end += nbytes
+        events = []
+        while self._parse_page(events):
+            pass
+        if self._start == self._end:
+            self._start = self._end = 0
+        return events
+
+    def _release(self):
+        for view in self._exports:
+            view.release()
+        self._exports.clear()
+
+    def _skip_to_capture_pattern(self):
+        """Skip to the next capture pattern, returning whether one was found."""
+        self._drop_continued_packet()
+        found = self._buffer.find(b'OggS', self._start + 1, self._end)
+        if found == -1:
+            # keep what may be the beginning of a capture pattern
+            found = self._end - 3
+        self._skipped += found - self._start
+        self.bytes_skipped += found - self._start
+        self._start = found
+        return self._buffer.startswith(b'OggS', found)
+
+    def _drop_continued_packet(self):
+        self._previous_page = bytearray()
+        self._discarding = False
+
+    def _parse_page(self, events):
+        """Parse one page if it has been fully received, returning whether it had."""
+        # for the spec, see: https://wiki.xiph.org/Ogg
+        buffer, view, offset = self._buffer, self._view, self._start
+        available = self._end - offset
+
+        if available < 27:
+            return False
+        header = PAGE_HEADER.unpack_from(buffer, offset)
         oggs, version, flags, pos, serial, pageseq, crc, segments = header
         # self._max_samplenum = max(self._max_samplenum, pos)
         if oggs != b'OggS' or version != 0:
-            raise Exception('Not a valid ogg file!')
-        segsizes = struct.unpack('B'*segments, fh.read(segments))
-        total = 0
-        for segsize in segsizes:  # read all segments
-            total += segsize
-            if total < 255:  # less than 255 bytes means end of page
-                yield previous_page + fh.read(total)
-                previous_page = b''
-                total = 0
-        if total != 0:
-            if total % 255 == 0:
-                previous_page += fh.read(total)
+            if not self.resync:
+                raise Exception('Not a valid ogg file!')
+            return self._skip_to_capture_pattern()
+        if self._skipped:
+            events.append(Resynced(self._skipped))
+            self._skipped = 0
+        if available < 27 + segments:
+            return False
+        start = end = offset + 27 + segments
+        segsizes = view[offset + 27:end]  # lacing values, read as a bytes sequence
+        page_end = end + sum(segsizes)
+        if self._end < page_end:
+            return False
+        self._start = page_end
+
+        streams, max_packet_size = self._streams, self.max_packet_size
+        bos, eos = flags & 2, flags & 4
+        index = streams.get(serial, -1)
+
+        header_page = bool(bos) or 0 <= index < HEADER_PACKETS
+        skimmed = self.skim and not header_page
+
+        # skimmed pages are only verified when passed on whole
+        if self.verify_crc and (self.pages or not skimmed) and page_crc(view[offset:page_end]) != crc:
+            if not skimmed:
+                self._drop_continued_packet()
+            events.append(CorruptPage(serial, pageseq))
+            return True
+
+        if self.pages:
+            page = view[offset:page_end]
+            self._exports.append(page)
+            events.append(Page(serial, header_page, page))
+
+        if skimmed:
+            if eos and streams.pop(serial, None) is not None:
+                events.append(StreamEnded(serial))
+            return True
+
+        if bos:
+            index = 0
+            events.append(StreamStarted(serial))
+
+        for segsize in segsizes:
+            end += segsize
+            if segsize == 255:  # a full segment means the packet continues
+                continue
+            size = len(self._previous_page) + end - start
+            if self._discarding:
+                self._discarding = False
+            elif max_packet_size is not None and size > max_packet_size:
+                events.append(PacketTooLarge(serial, size))
+                self._previous_page = bytearray()
             else:
-                yield previous_page + fh.read(total)
-                previous_page = b''
-        header_data = fh.read(27)
-
-def parse_comment(fh) -> List[tuple]:
-    # for the spec, see: http://xiph.org/vorbis/doc/v-comment.html
-    # discnumber tag based on: https://en.wikipedia.org/wiki/Vorbis_comment
-    # https://sno.phy.queensu.ca/~phil/exiftool/TagNames/Vorbis.html
-    comment_type_to_attr_mapping = {
-        'album': 'album',
-        'albumartist': 'albumartist',
-        'title': 'title',
-        'artist': 'artist',
-        'date': 'year',
-        'tracknumber': 'track',
-        'discnumber': 'disc',
-        'genre': 'genre',
-        'description': 'comment',
-        'composer': 'composer',
-    }
-    vendor_length = struct.unpack('I', fh.read(4))[0]
-    fh.seek(vendor_length, os.SEEK_CUR)  # jump over vendor
-    elements = struct.unpack('I', fh.read(4))[0]
+                if self._previous_page:
+                    self._previous_page += view[start:end]
+                    packet = memoryview(self._previous_page)
+                    # a fresh accumulator, in case the consumer kept a derived view
+                    self._previous_page = bytearray()
+                else:
+                    packet = view[start:end]
+                self._exports.append(packet)
+                events.append(Packet(serial, index, packet))
+            start = end
+
+            if index >= 0:
+                index += 1
+                if self.skim and index == HEADER_PACKETS:
+                    break
+        else:
+            if start != end and not self._discarding:  # packet continues on the next page
+                size = len(self._previous_page) + end - start
+                if max_packet_size is not None and size > max_packet_size:
+                    events.append(PacketTooLarge(serial, size))
+                    self._previous_page = bytearray()
+                    self._discarding = True
+                else:
+                    self._previous_page += view[start:end]
+
+        if eos:
+            if streams.pop(serial, None) is not None or bos:
+                events.append(StreamEnded(serial))
+        elif index >= 0:
+            streams[serial] = index
+        return True
+
+
+def parse_events(fh, skim=False, verify_crc=False, resync=False, max_packet_size=None, pages=False):
+    """
+    Yield the ``OggParser`` events for the Ogg pages read from ``fh``.
+
+    This is a blocking wrapper around ``OggParser`` which reads straight into
+    the parser's buffer. The data of a yielded ``Packet`` or ``Page`` is
+    released when the generator is resumed; use ``bytes(packet.data)`` to
+    keep it.
+    """
+    parser = OggParser(
+        skim=skim,
+        verify_crc=verify_crc,
+        resync=resync,
+        max_packet_size=max_packet_size,
+        pages=pages
+    )
+    readinto = getattr(fh, 'readinto1', fh.readinto)
+    # larger reads make a buffered reader holding data wait for more
+    size = io.DEFAULT_BUFFER_SIZE
+    while True:
+        nbytes = readinto(parser.get_buffer(size)[:size])
+        if not nbytes:
+            return
+        for event in parser.buffer_updated(nbytes):
+            yield event
+            if isinstance(event, (Packet, Page)):
+                event.data.release()
+
+
+def parse_pages(fh, skim=False, verify_crc=False):
+    """
+    Yield the packets contained in the Ogg pages read from ``fh``.
+
+    A yielded packet is a ``memoryview`` that is released when the generator
+    is resumed; use ``bytes(packet)`` to keep it.
+    """
+    for event in parse_events(fh, skim=skim, verify_crc=verify_crc):
+        if isinstance(event, Packet):
+            yield event.data
+
+
+# for the spec, see: http://xiph.org/vorbis/doc/v-comment.html
+# discnumber tag based on: https://en.wikipedia.org/wiki/Vorbis_comment
+# https://sno.phy.queensu.ca/~phil/exiftool/TagNames/Vorbis.html
+COMMENT_FIELDS = {
+    b'album': 'album',
+    b'albumartist': 'albumartist',
+    b'title': 'title',
+    b'artist': 'artist',
+    b'date': 'year',
+    b'tracknumber': 'track',
+    b'discnumber': 'disc',
+    b'genre': 'genre',
+    b'description': 'comment',
+    b'composer': 'composer',
+}
+
+
+class CommentFields:
+    """
+    Precompiled lookup of the Vorbis comment fields kept by ``parse_comment``.
+
+    ``tags`` are extra keys to keep on top of ``COMMENT_FIELDS``, reported
+    under their lower-cased name (eg. ``BPM`` as ``bpm``). With ``keep_all``
+    set every field is kept, known keys still being renamed.
+    """
+
+    def __init__(self, tags=(), keep_all=False):
+        self.mapping = dict(COMMENT_FIELDS)
+        for tag in tags or ():
+            self.mapping[tag.lower().encode('ascii')] = tag.lower()
+        self.keep_all = keep_all
+        # a field longer than this can not start with a kept key and "="
+        self.max_prefix = max(map(len, self.mapping)) + 1
+
+
+DEFAULT_COMMENT_FIELDS = CommentFields()
+
+
+def parse_comment(data, fields=DEFAULT_COMMENT_FIELDS) -> List[tuple]:
+    """
+    Return the fields of a Vorbis comment header as (field, value) pairs.
+
+    ``data`` is the header following its packet type and ``vorbis`` string,
+    as any bytes-like object (or, for compatibility, a file-like object).
+    ``fields`` is the ``CommentFields`` lookup deciding what to keep. Keys
+    are matched case-insensitively on their raw bytes, so unless every field
+    is kept only the values of kept fields are ever copied and decoded. A
+    truncated header yields the fields read so far.
+    """
+    if hasattr(data, 'read'):
+        data = data.read()
+    view = memoryview(data)
+    size = len(view)
+    mapping, max_prefix, keep_all = fields.mapping, fields.max_prefix, fields.keep_all
+
+    if size < 8:
+        return []
+    pos = 4 + UINT32.unpack_from(view)[0]  # jump over vendor
+    if pos + 4 > size:
+        return []
+    elements = UINT32.unpack_from(view, pos)[0]
+    pos += 4
 
     metadata = []
 
     for _ in range(elements):
-        length = struct.unpack('I', fh.read(4))[0]
-        try:
-            keyvalpair = codecs.decode(fh.read(length), 'UTF-8')
-        except UnicodeDecodeError:
-            continue
-        if '=' in keyvalpair:
-            key, value = keyvalpair.split('=', 1)
-            fieldname = comment_type_to_attr_mapping.get(key.lower())
-            if fieldname:
-                metadata.append((fieldname, value))
+        if pos + 4 > size:
+            break
+        length = UINT32.unpack_from(view, pos)[0]
+        pos += 4
+        end = pos + length
+        if end > size:
+            break
+        if keep_all:
+            try:
+                key, separator, value = str(view[pos:end], 'utf-8').partition('=')
+            except UnicodeDecodeError:
+                separator = None
+            if separator:
+                key = key.lower()
+                metadata.append((mapping.get(key.encode('ascii', 'replace'), key), value))
+        else:
+            separator = bytes(view[pos:pos + min(length, max_prefix)]).find(b'=')
+            if separator != -1:
+                fieldname = mapping.get(bytes(view[pos:pos + separator]).lower())
+                if fieldname:
+                    try:
+                        metadata.append((fieldname, str(view[pos + separator + 1:end], 'utf-8')))
+                    except UnicodeDecodeError:
+                        pass
+        pos = end
 
     return metadata
+
+
+def comment_from_event(event, fields=DEFAULT_COMMENT_FIELDS):
+    """
+    Return the fields of a parser event if it is a Vorbis comment header (the
+    second packet of its logical stream), or ``None`` otherwise.
+    """
+    if type(event) is Packet and event.index == 1 and event.data[:7] == b'\x03vorbis':
+        return parse_comment(event.data[7:], fields)  # jump over header name
+    return None
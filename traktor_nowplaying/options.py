@@ -4,3 +4,29 @@ OUTPUT_FORMAT = '{{artist}} - {{title}}'
 INTERACTIVE = False
 APPEND = False
 MAX_TRACKS = None
+VERIFY_CRC = False
+TAGS = None
+ALL_TAGS = False
+MAX_PACKET_SIZE = 1024 * 1024
+MAX_CONNECTIONS = 8
+MAX_CLIENTS = 64
+RECV_BUFFER = None
+KEEPALIVE = None
+REUSE_PORT = False
+WORKERS = 1
+IDLE_TIMEOUT = None
+QUEUE_SIZE = 64
+DISPATCH_WORKERS = 1
+OVERFLOW = 'drop-oldest'
+RELAY = None
+RELAY_BUFFER = 1024 * 1024
+RELAY_TIMEOUT = 5
+SERVE_STREAM = False
+STREAM_BUFFER = 256
+SERVE_JSON = False
+HISTORY_SIZE = 20
+HEARTBEAT_INTERVAL = 15
+WEBSOCKET_BUFFER = 64 * 1024
+SERVE_OUTPUT = False
+TRIM_SLACK = None
+REQUEST_TIMEOUT = 10
@@ -0,0 +1,74 @@
+"""
+Contains the buffer of pages the incoming stream is served to listeners from.
+"""
+
+from collections import deque
+from typing import List, Tuple
+import itertools
+import threading
+
+from .options import STREAM_BUFFER
+
+
+class StreamBuffer:
+    """
+    Ring buffer of the latest ``size`` Ogg pages of a mount's stream, shared
+    by every listener: each page is copied once, when published, and
+    listeners only keep their position in the buffer.
+
+    The header pages of the current logical stream are kept aside, so that
+    listeners joining late get them first and can start decoding right
+    away, before carrying on from the live end of the buffer. A listener
+    falling more than ``size`` pages behind skips ahead to the oldest page
+    still buffered.
+    """
+
+    def __init__(self, size=STREAM_BUFFER):
+        self.size = size
+        self.closed = False
+        self._pages = deque(maxlen=size)
+        self._next = 0  # position of the next page published
+        self._headers = []  # header pages of the current logical stream
+        self._in_headers = False  # whether the last page published was a header
+        self._changed = threading.Condition()
+
+    def publish(self, page):
+        """Add a ``Page`` event to the buffer."""
+        data = bytes(page.data)
+        with self._changed:
+            if page.header:
+                if not self._in_headers:
+                    # a new logical stream, whose headers replace the previous ones
+                    self._headers = []
+                self._headers.append(data)
+            self._in_headers = page.header
+            self._pages.append(data)
+            self._next += 1
+            self._changed.notify_all()
+
+    def subscribe(self) -> Tuple[int, List[bytes]]:
+        """Return the position of a new listener and the header pages to send it."""
+        with self._changed:
+            # headers still to come are published from that position on
+            return self._next, list(self._headers)
+
+    def pages_after(self, position) -> Tuple[int, List[bytes]]:
+        """Return the pages published from ``position`` on, and the position following them."""
+        first = self._next - len(self._pages)
+        start = max(position, first) - first
+        return self._next, list(itertools.islice(self._pages, start, None))
+
+    def wait(self, position, timeout=None) -> Tuple[int, List[bytes]]:
+        """
+        Like ``pages_after``, but waiting up to ``timeout`` seconds for pages
+        to be published first.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._next > position or self.closed, timeout)
+            return self.pages_after(position)
+
+    def close(self):
+        """Wake up the listeners waiting for pages, for good."""
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
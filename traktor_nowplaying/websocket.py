@@ -0,0 +1,194 @@
+"""
+Contains a minimal WebSocket (RFC 6455) implementation, for pushing track
+changes to overlays.
+"""
+
+from collections import deque
+from typing import List, Tuple
+import base64
+import hashlib
+import socket
+import struct
+import threading
+
+from .options import WEBSOCKET_BUFFER
+
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+CONTINUATION, TEXT, BINARY, CLOSE, PING, PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+
+# close status codes
+NORMAL, GOING_AWAY, PROTOCOL_ERROR = 1000, 1001, 1002
+
+# largest frame accepted from clients, which only send control frames to us
+MAX_FRAME_SIZE = 64 * 1024
+
+# how often handlers look for frames to flush to slow clients, in seconds
+POLL_INTERVAL = 0.5
+
+
+def accept_key(key) -> str:
+    """Return the ``Sec-WebSocket-Accept`` value answering a ``Sec-WebSocket-Key``."""
+    digest = hashlib.sha1(key.strip().encode('ascii') + GUID).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def encode_frame(payload=b'', opcode=TEXT) -> bytes:
+    """Encode a single, unmasked frame as sent by servers."""
+    size = len(payload)
+    if size < 126:
+        header = struct.pack('!BB', 0x80 | opcode, size)
+    elif size < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+    return header + payload
+
+
+def close_frame(code=NORMAL) -> bytes:
+    return encode_frame(struct.pack('!H', code), CLOSE)
+
+
+PING_FRAME = encode_frame(b'', PING)
+
+
+class FrameParser:
+    """
+    Incremental parser of the (masked) frames sent by clients. ``feed``
+    returns the ``(opcode, payload)`` of the frames completed by the data,
+    and raises ``ValueError`` on frames that break the protocol.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data) -> List[Tuple[int, bytes]]:
+        self._buffer += data
+        frames = []
+        while True:
+            frame = self._parse_frame()
+            if frame is None:
+                return frames
+            frames.append(frame)
+
+    def _parse_frame(self):
+        buffer = self._buffer
+        if len(buffer) < 2:
+            return None
+
+        opcode, size = buffer[0] & 0x0F, buffer[1] & 0x7F
+        if not buffer[1] & 0x80:
+            raise ValueError('Unmasked frame from client')
+
+        offset = 2
+        if size == 126:
+            offset = 4
+            if len(buffer) >= offset:
+                size, = struct.unpack_from('!H', buffer, 2)
+        elif size == 127:
+            offset = 10
+            if len(buffer) >= offset:
+                size, = struct.unpack_from('!Q', buffer, 2)
+        if size > MAX_FRAME_SIZE:
+            raise ValueError('Frame too large')
+        if len(buffer) < offset + 4 + size:
+            return None
+
+        mask = bytes(buffer[offset:offset + 4]) * (size // 4 + 1)
+        start = offset + 4
+        payload = int.from_bytes(buffer[start:start + size], 'big') ^ int.from_bytes(mask[:size], 'big')
+        del buffer[:start + size]
+        return opcode, payload.to_bytes(size, 'big')
+
+
+class WebSocketClient:
+    """
+    A WebSocket connection on a non-blocking socket, which frames are
+    broadcast to from any thread.
+
+    ``send`` never waits on the client: frames go straight to the socket,
+    and only what the socket does not take right away is kept, to be sent
+    by ``flush`` once it is writable again. A client with more than
+    ``max_pending`` bytes kept is too slow to keep up and is evicted: its
+    connection is closed, and the other clients are not held up.
+    """
+
+    def __init__(self, sock, max_pending=WEBSOCKET_BUFFER):
+        self.sock = sock
+        self.max_pending = max_pending
+        self.closed = False
+        self._pending = deque()  # views of frames (or what is left of them) not sent yet
+        self._pending_size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return bool(self._pending)
+
+    def send(self, frame):
+        """Send ``frame`` without waiting, keeping what could not be sent."""
+        with self._lock:
+            if self.closed:
+                return
+            self._pending.append(memoryview(frame))
+            self._pending_size += len(frame)
+            self._flush()
+            if self._pending_size > self.max_pending:
+                self._close()
+
+    def flush(self):
+        """Send as much of the frames kept as the socket takes right away."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        try:
+            while self._pending:
+                frame = self._pending[0]
+                sent = self.sock.send(frame)
+                self._pending_size -= sent
+                if sent < len(frame):
+                    self._pending[0] = frame[sent:]
+                    return
+                self._pending.popleft()
+        except BlockingIOError:
+            pass
+        except OSError:
+            # the client went away
+            self._close()
+
+    def close(self, code=None):
+        """Close the connection, sending a close frame with ``code`` if given."""
+        with self._lock:
+            if code is not None and not self.closed and not self._pending:
+                try:
+                    self.sock.send(close_frame(code))
+                except OSError:
+                    pass
+            self._close()
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._pending.clear()
+        self._pending_size = 0
+        try:
+            # wakes up the handler waiting on the connection
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def handle_frame(client, opcode, payload):
+    """
+    Answer a frame received from ``client``, returning whether the
+    connection stays open. Messages from clients are ignored.
+    """
+    if opcode == PING:
+        client.send(encode_frame(payload, PONG))
+    elif opcode == CLOSE:
+        client.close(struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else NORMAL)
+        return False
+    return True